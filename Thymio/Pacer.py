@@ -0,0 +1,122 @@
+import time
+from typing import Any, Callable
+
+from Thymio.Logger import logger
+from Thymio.Exceptions import ThymioException
+from Thymio.Thymio import Thymio
+
+"""
+Adaptive pacing for control loops. Only the loop rate adapts: the TDM pushes sensor updates whenever the values change
+and tdmclient has no way to request a different sensor update rate. The Thymio firmware refreshes prox.horizontal at
+about 10Hz, so the loop rate is capped there; ticking faster would only re-read the same values.
+"""
+
+
+def proximity_urgency(close_limit: int = 4000, far_limit: int = 1000, sensors: tuple[int, ...] = (0, 1, 2, 3, 4)) \
+        -> Callable[[Any], float]:
+    """
+    Create an urgency function which rises from 0 to 1 as the closest of the horizontal proximity sensors moves from
+    far_limit to close_limit.
+    :param close_limit: integer of the proximity reading that is fully urgent
+    :param far_limit: integer of the proximity reading below which there is no urgency
+    :param sensors: tuple of the prox.horizontal indexes to consider, defaults to the front sensors
+    :return: function taking the node variables and returning the urgency
+    """
+    if close_limit <= far_limit:
+        raise ThymioException(f"close_limit ({close_limit}) must be greater than far_limit ({far_limit})")
+
+    def urgency(v) -> float:
+        closest = max(v.prox.horizontal[i] for i in sensors)
+        return (closest - far_limit) / (close_limit - far_limit)
+
+    return urgency
+
+
+class AdaptivePacer:
+    """
+    Paces a control loop between a minimum and maximum rate based on how urgent the latest sensor values are. The rate
+    never drops below moving_rate while the motors are running, and a sleeping loop wakes up early as soon as the
+    urgency calls for a faster rate.
+    """
+    SENSOR_RATE = 10
+
+    def __init__(self, client, th: Thymio, urgency: Callable[[Any], float], min_rate: float = 2,
+                 max_rate: float = SENSOR_RATE, moving_rate: float = SENSOR_RATE, hysteresis: float = 0.1):
+        """
+        Create an AdaptivePacer which starts at the minimum rate.
+        :param client: ClientAsync object used to sleep between ticks
+        :param th: Thymio object whose node variables are passed to the urgency function
+        :param urgency: function taking the node variables and returning the urgency from 0 (idle) to 1 (urgent).
+        Values outside of that range are clamped.
+        :param min_rate: float of the loop rate in Hz when the robot is stopped and there is no urgency
+        :param max_rate: float of the loop rate in Hz when fully urgent, at most SENSOR_RATE
+        :param moving_rate: float of the lowest loop rate in Hz while the motors are running
+        :param hysteresis: float of how far the urgency has to move (0 to 1) before the rate is changed
+        """
+        if min_rate <= 0 or not min_rate <= max_rate <= self.SENSOR_RATE or not min_rate <= moving_rate <= max_rate:
+            raise ThymioException(f"Invalid rates: min_rate={min_rate}, max_rate={max_rate}, "
+                                  f"moving_rate={moving_rate}, sensor rate={self.SENSOR_RATE}")
+        if not 0 <= hysteresis < 1:
+            raise ThymioException(f"Invalid hysteresis: {hysteresis}")
+        self.client = client
+        self.th = th
+        self.urgency = urgency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.moving_rate = moving_rate
+        self.hysteresis = hysteresis
+        self.level = 0.0
+        self.rate = min_rate
+        self.__last_tick__ = None
+
+    def __next_level__(self) -> float:
+        """
+        Get the urgency level from the latest sensor values. It only moves once it is further than the hysteresis from
+        the current level, except when leaving idle or reaching either end, which happen straight away.
+        :return: float of the urgency level from 0 to 1
+        """
+        level = min(1.0, max(0.0, self.urgency(self.th.node.v)))
+        if abs(level - self.level) > self.hysteresis or self.level == 0.0 or level in (0.0, 1.0):
+            return level
+        return self.level
+
+    def __rate_for__(self, level: float) -> float:
+        rate = self.min_rate + level * (self.max_rate - self.min_rate)
+        if self.th.moving:
+            rate = max(rate, self.moving_rate)
+        return rate
+
+    def update(self) -> float:
+        """
+        Recalculate the rate from the latest sensor values and motor targets.
+        :return: float of the loop rate in Hz
+        """
+        self.level = self.__next_level__()
+        rate = self.__rate_for__(self.level)
+        if rate != self.rate:
+            logger.debug(f"Changing loop rate from {self.rate:.1f}Hz to {rate:.1f}Hz (urgency {self.level:.2f}, "
+                         f"motors {self.th.motor_targets})")
+            self.rate = rate
+        return self.rate
+
+    @property
+    def period(self) -> float:
+        """
+        Get the current loop period.
+        :return: float of the loop period in seconds
+        """
+        return 1 / self.rate
+
+    async def sleep(self):
+        """
+        Sleep until the next tick. Time spent in the loop since the previous tick counts towards the period. The sleep
+        ends early once new sensor values call for a faster rate, which tdmclient checks every time it polls for
+        messages (every 0.1s at most).
+        """
+        self.update()
+        now = time.monotonic()
+        delay = self.period
+        if self.__last_tick__ is not None:
+            delay = max(0.0, self.__last_tick__ + self.period - now)
+        await self.client.sleep(delay, wake=lambda: self.__rate_for__(self.__next_level__()) > self.rate)
+        self.__last_tick__ = time.monotonic()
@@ -7,15 +7,16 @@ from Thymio.Thymio import Thymio
 
 
 class Runner:
-    def __init__(self, client_addr=None, client_port=None, client_password=None):
+    def __init__(self, client_addr=None, client_port=None, client_password=None, node_name=None):
         self.client_addr = client_addr
         self.client_port = client_port
         self.client_password = client_password
+        self.node_name = node_name
 
     def run(self, program: Callable[[ClientAsync, Thymio], Awaitable[Any]]):
         logger.debug(f"Connecting to client {self.client_addr}:{self.client_port} with password {self.client_password}")
         with ClientAsync(tdm_addr=self.client_addr, tdm_port=self.client_port, password=self.client_password) as client:
-            with Thymio(client) as th:
+            with Thymio(client, node_name=self.node_name) as th:
                 async def prog():
                     await program(client, th)
 
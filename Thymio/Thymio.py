@@ -37,6 +37,7 @@ class Thymio:
         """
         self.client = client
         self.temp_in_fahrenheit = temp_in_fahrenheit
+        self.motor_targets = None
         aw(self.client.sleep(delay_for_nodes))
 
         if prompt_node:
@@ -147,18 +148,31 @@ class Thymio:
         return celsius * 9 / 5 + 32
 
     # Action Functions
-    async def motors(self, left: int, right: int):
+    async def motors(self, left: int, right: int, force: bool = False):
         """
-        Set the motor speeds. Range of -500 to 500.
+        Set the motor speeds. Range of -500 to 500. Nothing is sent if the speeds are the same as the last ones set.
         :param left: Integer of left wheel target speed.
         :param right: Integer of right wheel target speed.
+        :param force: boolean of whether to send the speeds even if they haven't changed
         """
+        targets = (min(500, max(-500, left)), min(500, max(-500, right)))
+        if targets == self.motor_targets and not force:
+            return
         v = {
-            "motor.left.target": [min(500, max(-500, left))],
-            "motor.right.target": [min(500, max(-500, right))]
+            "motor.left.target": [targets[0]],
+            "motor.right.target": [targets[1]]
         }
         logger.debug(f"Setting motors to {v}")
         await self.node.set_variables(v)
+        self.motor_targets = targets
+
+    @property
+    def moving(self) -> bool:
+        """
+        Whether the last motor speeds set are running the robot.
+        :return: boolean of whether either motor target is non-zero
+        """
+        return self.motor_targets is not None and any(self.motor_targets)
 
     async def circle_leds(self, front: int = 0, front_right: int = 0, right: int = 0, back_right: int = 0,
                           back: int = 0, back_left: int = 0, left: int = 0, front_left: int = 0):
@@ -1,11 +1,14 @@
 from Thymio.Logger import logger
 from Thymio.Exceptions import ThymioException
+from Thymio.Pacer import AdaptivePacer, proximity_urgency
 
 
 async def avoid_obstacles(client, th):
+    close_limit = 4000
+    # this program always drives, so the pacer holds it at the sensor rate
+    pacer = AdaptivePacer(client, th, proximity_urgency(close_limit=close_limit))
     await th.node.wait_for_variables({"prox.horizontal"})
     while True:
-        close_limit = 4000
         prox_front_left = th.node.v.prox.horizontal[0]
         prox_front_middle_left = th.node.v.prox.horizontal[1]
         prox_front = th.node.v.prox.horizontal[2]
@@ -40,4 +43,4 @@ async def avoid_obstacles(client, th):
             right_speed = 500
 
         await th.motors(left_speed, right_speed)
-        await client.sleep(0.1)
+        await pacer.sleep()
@@ -1,18 +1,21 @@
 import argparse
 
 from Thymio.Logger import logger
+from Thymio.Pacer import AdaptivePacer, proximity_urgency
 from Thymio.Runner import Runner
 from avoid_obstacles import avoid_obstacles
 from manual_control import manual_control
 
 
 async def actual_prog(client, th):
+    # -prox_front // 10 moves the robot for any reading above 0
+    pacer = AdaptivePacer(client, th, proximity_urgency(far_limit=0, sensors=(2,)))
     await th.node.wait_for_variables({"prox.horizontal"})
     while True:
         prox_front = th.node.v.prox.horizontal[2]
         speed = -prox_front // 10
         await th.motors(speed, speed)
-        await client.sleep(0.1)
+        await pacer.sleep()
 
 
 PROGRAMS = {
@@ -30,6 +33,7 @@ if __name__ == '__main__':
                         help="The address of the client to connect to. Defaults to the local device.")
     parser.add_argument("--client_port", default=None, type=int, help="The port of the client to connect to.")
     parser.add_argument("--client_password", default=None, help="The password of the client to connect to.")
+    parser.add_argument("--node_name", default=None, help="The name of the robot to connect to.")
     parser.add_argument("--list-programs", action="store_true", help="List the available programs")
     parser.add_argument("--program", default="test", help="The program to run", choices=PROGRAMS.keys())
     args = parser.parse_args()
@@ -41,6 +45,6 @@ if __name__ == '__main__':
         exit(0)
 
     logger.info("Starting program")
-    runner = Runner(args.client_addr, args.client_port, args.client_password)
+    runner = Runner(args.client_addr, args.client_port, args.client_password, args.node_name)
     runner.run(PROGRAMS[args.program])
     logger.info("End of program")
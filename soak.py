@@ -0,0 +1,433 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+import tdmclient
+import tdmclient.clientasync
+from tdmclient import Server, ServerNode, ThymioFB
+
+from Thymio.Logger import logger
+from Thymio.Runner import Runner
+from main import PROGRAMS
+
+"""
+Soak harness which runs programs through Runner against a local dummy TDM for a long period of time and fails if the
+memory usage, driver busy time, or command latency drifts past the configured bounds.
+
+Usage:
+python soak.py --program avoid_obstacles --robots 4 --duration 3600
+"""
+
+# manual_control needs a physical gamepad so it can't be soaked
+SOAK_PROGRAMS = {name: program for name, program in PROGRAMS.items() if name != "manual_control"}
+
+tdmclient_sleep = threading.local()
+
+
+class SimulatedTDM(multiprocessing.Process):
+    """
+    Local TDM serving dummy Thymio nodes from a child process, so the server's own allocations don't count towards the
+    memory of the robots being soaked. The proximity sensors wander around on the server side and the changes are
+    pushed to every connected client, the same way a real TDM reports sensor updates.
+    """
+    PROX_MAX = 3500
+
+    def __init__(self, robots: int, port: int, update_rate: float = 10, seed: int = None):
+        """
+        Create a SimulatedTDM.
+        :param robots: integer of the number of nodes to serve, named sim-0 to sim-(robots - 1)
+        :param port: integer of the TCP port to listen on
+        :param update_rate: float of how many times per second the sensors are updated
+        :param seed: integer seed for the proximity sensor random walk
+        """
+        super().__init__(daemon=True)
+        self.robots = robots
+        self.port = port
+        self.update_rate = update_rate
+        self.seed = seed
+        self.ready = multiprocessing.Event()
+
+    @property
+    def node_names(self) -> list[str]:
+        return [f"sim-{i}" for i in range(self.robots)]
+
+    def run(self):
+        nodes = [ServerNode(type=ThymioFB.NODE_TYPE_THYMIO2, name=name,
+                            variables={
+                                "prox.horizontal": [0] * 7,
+                                "motor.left.target": [0],
+                                "motor.right.target": [0],
+                            })
+                 for name in self.node_names]
+        connections = set()
+        lock = threading.Lock()
+
+        def on_accept(output_packet_queue: queue.Queue):
+            # keep the outgoing packet queue of every client so sensor updates can be pushed to it
+            with lock:
+                connections.add(output_packet_queue)
+
+            def on_close():
+                with lock:
+                    connections.discard(output_packet_queue)
+
+            return None, on_close
+
+        server = Server(port=self.port)
+        server.nodes.update(nodes)
+        server.on_accept = on_accept
+        server.start()
+        threading.Thread(target=server.loop_forever, daemon=True).start()
+        self.ready.set()
+
+        thymio_fb = ThymioFB()
+        rand = random.Random(self.seed)
+        while True:
+            time.sleep(1 / self.update_rate)
+            # keep the sensors below the range where avoid_obstacles gives up
+            for node in nodes:
+                node.variables["prox.horizontal"] = [min(self.PROX_MAX, max(0, value + rand.randint(-300, 300)))
+                                                     for value in node.variables["prox.horizontal"]]
+                packet = thymio_fb.create_message((
+                    ThymioFB.MESSAGE_TYPE_VARIABLES_CHANGED,
+                    (
+                        (ThymioFB.id_str_to_bytes(node.id),),
+                        [("prox.horizontal", node.variables["prox.horizontal"])],
+                    ),
+                ), ThymioFB.SCHEMA)
+                with lock:
+                    for connection in connections:
+                        connection.put(packet)
+
+    def stop(self):
+        """
+        Stop the server. tdmclient's connection threads never exit on their own, so the process is terminated.
+        """
+        self.terminate()
+        self.join()
+
+
+def track_tdmclient_sleep():
+    """
+    tdmclient polls for messages with a blocking time.sleep inside its coroutines. Replace it with one which adds up
+    the time slept on each thread, so that the intentional polling can be taken out of the driver busy times.
+    """
+    def tracked_sleep(seconds: float):
+        start = time.perf_counter()
+        time.sleep(seconds)
+        tdmclient_sleep.total = tdmclient_slept() + time.perf_counter() - start
+
+    tdmclient.clientasync.sleep = tracked_sleep
+
+
+def tdmclient_slept() -> float:
+    """
+    Get the time the current thread has spent sleeping in tdmclient.
+    :return: float of the time in seconds
+    """
+    return getattr(tdmclient_sleep, "total", 0.0)
+
+
+class Robot(threading.Thread):
+    """
+    Runs a program on one robot through Runner in its own thread, recording how busy each step of the driver loop is
+    and how long each set_variables command takes.
+    """
+    def __init__(self, runner: Runner, program):
+        """
+        Create a Robot.
+        :param runner: Runner object connected to the robot's TDM and node
+        :param program: async function taking a client and a Thymio object
+        """
+        super().__init__(daemon=True)
+        self.runner = runner
+        self.program = program
+        self.error = None
+        self.stop_requested = threading.Event()
+        self.__busy__ = []
+        self.__latencies__ = []
+        self.__lock__ = threading.Lock()
+
+    def drain(self) -> tuple[list[float], list[float]]:
+        """
+        Return the driver busy times and command latencies recorded since the last call and reset them.
+        :return: tuple of the lists of busy times and latencies in seconds
+        """
+        with self.__lock__:
+            busy, self.__busy__ = self.__busy__, []
+            latencies, self.__latencies__ = self.__latencies__, []
+        return busy, latencies
+
+    @types.coroutine
+    def __drive__(self, co):
+        """
+        Step the program coroutine for ClientAsync.run_async_program until a stop is requested. The busy time of a step
+        is its duration minus the time tdmclient spent polling in time.sleep, which leaves the time spent in the
+        program, the logging, and the tdmclient message handling.
+        """
+        try:
+            while not self.stop_requested.is_set():
+                start = time.perf_counter()
+                slept = tdmclient_slept()
+                try:
+                    co.send(None)
+                except StopIteration:
+                    raise RuntimeError("Program exited before the end of the soak")
+                busy = time.perf_counter() - start - (tdmclient_slept() - slept)
+                with self.__lock__:
+                    self.__busy__.append(busy)
+                yield
+        finally:
+            co.close()
+
+    async def __soak_program__(self, client, th):
+        set_variables = th.node.set_variables
+
+        async def timed_set_variables(variables: dict):
+            start = time.perf_counter()
+            result = await set_variables(variables)
+            with self.__lock__:
+                self.__latencies__.append(time.perf_counter() - start)
+            return result
+
+        # Thymio.motors skips unchanged speeds, so time the commands actually sent
+        th.node.set_variables = timed_set_variables
+        await self.__drive__(self.program(client, th))
+
+    def run(self):
+        try:
+            self.runner.run(self.__soak_program__)
+        except Exception as e:
+            self.error = e
+
+
+class Sample:
+    """
+    A single measurement of the process taken by the soak harness.
+    """
+    def __init__(self, elapsed: float, rss_mb: float, traced_mb: float, busy_ms: float, latency_ms: float):
+        """
+        :param elapsed: float of seconds since the soak started
+        :param rss_mb: float of the resident set size in MB
+        :param traced_mb: float of the memory currently traced by tracemalloc in MB
+        :param busy_ms: float of the 95th percentile driver busy time per step in the sample window
+        :param latency_ms: float of the 95th percentile set_variables command latency in the sample window, or None if
+        no commands were sent
+        """
+        self.elapsed = elapsed
+        self.rss_mb = rss_mb
+        self.traced_mb = traced_mb
+        self.busy_ms = busy_ms
+        self.latency_ms = latency_ms
+
+    def __str__(self):
+        return (f"t={self.elapsed:.0f}s rss={self.rss_mb:.1f}MB traced={self.traced_mb:.2f}MB "
+                f"busy_p95={self.busy_ms:.2f}ms "
+                f"latency_p95={'n/a' if self.latency_ms is None else f'{self.latency_ms:.2f}ms'}")
+
+
+def rss_mb() -> float:
+    """
+    Get the current resident set size of the process. Falls back to the peak resident set size on platforms without
+    /proc.
+    :return: float of the resident set size in MB
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes, Linux reports kilobytes
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def free_port() -> int:
+    """
+    Find a free local TCP port for the TDM.
+    :return: integer of the port
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+def p95(values: list[float]) -> float:
+    """
+    Get the 95th percentile of a list of values.
+    :param values: list of floats
+    :return: float of the 95th percentile, or 0 if there are no values
+    """
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=20)[-1]
+
+
+def allocation_filters() -> list[tracemalloc.Filter]:
+    """
+    Limit tracemalloc reports to the repository and tdmclient, minus this harness and the tdmclient server, so the top
+    allocators point at Thymio, program, and client code rather than the harness or the standard library.
+    :return: list of tracemalloc Filters
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    return [
+        tracemalloc.Filter(True, os.path.join(repo, "*")),
+        tracemalloc.Filter(True, os.path.join(os.path.dirname(tdmclient.__file__), "*")),
+        tracemalloc.Filter(False, os.path.abspath(__file__)),
+        tracemalloc.Filter(False, os.path.join(os.path.dirname(tdmclient.__file__), "server*.py")),
+    ]
+
+
+def check_drift(samples: list[Sample], max_rss_growth: float, max_traced_growth: float, max_busy_growth: float,
+                max_latency_growth: float) -> list[str]:
+    """
+    Compare the start of the soak against the end of it.
+    :param samples: list of Samples taken after the warmup
+    :param max_rss_growth: float of the allowed resident set size growth in MB
+    :param max_traced_growth: float of the allowed tracemalloc growth in MB
+    :param max_busy_growth: float of the allowed driver busy time growth in ms
+    :param max_latency_growth: float of the allowed command latency growth in ms
+    :return: list of strings describing every bound that was crossed
+    """
+    window = max(1, len(samples) // 4)
+    first, last = samples[:window], samples[-window:]
+
+    def growth(attr):
+        # windows without a value, like no commands sent, don't count towards either end
+        start_values = [getattr(s, attr) for s in first if getattr(s, attr) is not None]
+        end_values = [getattr(s, attr) for s in last if getattr(s, attr) is not None]
+        if not start_values or not end_values:
+            return 0.0, 0.0
+        return statistics.mean(start_values), statistics.mean(end_values)
+
+    failures = []
+    start, end = growth("rss_mb")
+    if end - start > max_rss_growth:
+        failures.append(f"RSS grew {end - start:.1f}MB ({start:.1f}MB -> {end:.1f}MB), limit {max_rss_growth}MB")
+    start, end = growth("traced_mb")
+    if end - start > max_traced_growth:
+        failures.append(f"Traced memory grew {end - start:.2f}MB ({start:.2f}MB -> {end:.2f}MB), "
+                        f"limit {max_traced_growth}MB")
+    start, end = growth("busy_ms")
+    if end - start > max_busy_growth:
+        failures.append(f"Driver busy time grew {end - start:.2f}ms ({start:.2f}ms -> {end:.2f}ms), "
+                        f"limit {max_busy_growth}ms")
+    start, end = growth("latency_ms")
+    if end - start > max_latency_growth:
+        failures.append(f"Command latency grew {end - start:.2f}ms ({start:.2f}ms -> {end:.2f}ms), "
+                        f"limit {max_latency_growth}ms")
+    return failures
+
+
+def soak(program, robots: int, duration: float, sample_interval: float, warmup: float, top: int) -> list[Sample]:
+    """
+    Run the program on every robot of a local dummy TDM for the duration while sampling the process. The TDM runs in a
+    child process, so the memory samples only cover the robots.
+    :param program: async function taking a client and a Thymio object
+    :param robots: integer of the number of simulated robots
+    :param duration: float of the seconds to run for, including the warmup
+    :param sample_interval: float of the seconds between samples
+    :param warmup: float of the seconds to run before sampling starts
+    :param top: integer of the number of top allocators to log at the end
+    :return: list of Samples taken after the warmup
+    """
+    track_tdmclient_sleep()
+    tdm = SimulatedTDM(robots, free_port())
+    tdm.start()
+    tdm.ready.wait()
+    fleet = [Robot(Runner("127.0.0.1", tdm.port, node_name=name), program) for name in tdm.node_names]
+    for robot in fleet:
+        robot.start()
+
+    def check_fleet():
+        for robot in fleet:
+            if robot.error:
+                raise robot.error
+            if not robot.is_alive():
+                raise RuntimeError(f"Robot thread for '{robot.runner.node_name}' exited before the end of the soak")
+
+    samples = []
+    start = time.perf_counter()
+    try:
+        time.sleep(warmup)
+        check_fleet()
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot().filter_traces(allocation_filters())
+        for robot in fleet:
+            robot.drain()
+
+        while time.perf_counter() - start < duration:
+            time.sleep(sample_interval)
+            check_fleet()
+            busy, latencies = [], []
+            for robot in fleet:
+                robot_busy, robot_latencies = robot.drain()
+                busy += robot_busy
+                latencies += robot_latencies
+            sample = Sample(time.perf_counter() - start, rss_mb(), tracemalloc.get_traced_memory()[0] / 1024 / 1024,
+                            p95(busy) * 1000, p95(latencies) * 1000 if latencies else None)
+            samples.append(sample)
+            logger.info(f"Soak sample: {sample}")
+
+        stats = tracemalloc.take_snapshot().filter_traces(allocation_filters()).compare_to(baseline, "lineno")
+        logger.info(f"Top {top} allocators since warmup:")
+        for stat in stats[:top]:
+            logger.info(f"  {stat}")
+    finally:
+        tracemalloc.stop()
+        for robot in fleet:
+            robot.stop_requested.set()
+        for robot in fleet:
+            robot.join(timeout=5)
+        tdm.stop()
+    return samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Thymio Soak Harness")
+    parser.add_argument("--loglevel", default='debug',
+                        help="The log level of the log file. Defaults to debug so the debug logging in the programs "
+                             "is exercised. The console only shows info and above.",
+                        choices=["critical", "error", "warn", "info", "debug"])
+    parser.add_argument("--program", default="avoid_obstacles", help="The program to soak",
+                        choices=SOAK_PROGRAMS.keys())
+    parser.add_argument("--robots", default=4, type=int, help="The number of simulated robots")
+    parser.add_argument("--duration", default=600, type=float, help="Seconds to run for, including the warmup")
+    parser.add_argument("--warmup", default=30, type=float, help="Seconds to run before taking samples")
+    parser.add_argument("--sample-interval", default=10, type=float, help="Seconds between samples")
+    parser.add_argument("--top", default=10, type=int, help="The number of top allocators to report")
+    parser.add_argument("--max-rss-growth", default=20, type=float, help="Allowed RSS growth in MB")
+    parser.add_argument("--max-traced-growth", default=5, type=float, help="Allowed tracemalloc growth in MB")
+    parser.add_argument("--max-busy-growth", default=5, type=float, help="Allowed driver busy time growth in ms")
+    parser.add_argument("--max-latency-growth", default=20, type=float, help="Allowed command latency growth in ms")
+    args = parser.parse_args()
+    logger.setLevel(args.loglevel.upper())
+    for handler in logger.handlers:
+        if not isinstance(handler, logging.FileHandler):
+            handler.setLevel(logging.INFO)
+    if args.duration <= args.warmup:
+        parser.error("--duration must be longer than --warmup")
+
+    logger.info(f"Soaking '{args.program}' on {args.robots} simulated robots for {args.duration}s")
+    samples = soak(SOAK_PROGRAMS[args.program], args.robots, args.duration, args.sample_interval, args.warmup,
+                   args.top)
+    if not samples:
+        logger.error("No samples were taken, increase --duration or decrease --sample-interval")
+        exit(1)
+    failures = check_drift(samples, args.max_rss_growth, args.max_traced_growth, args.max_busy_growth,
+                           args.max_latency_growth)
+    for failure in failures:
+        logger.error(f"Drift bound exceeded: {failure}")
+    if failures:
+        exit(1)
+    logger.info("Soak passed")